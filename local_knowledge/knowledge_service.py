@@ -3,6 +3,15 @@ import os
 import importlib.util
 from typing import List, Dict, Optional, Union, Any
 
+from .token_budget import TokenizedText, estimate_tokens, allocate_budget, continuation_cache
+
+# 每条知识的标题（如"知识 0:"）及分隔符预留的token数量
+_ENTRY_OVERHEAD_TOKENS = 8
+# 截断提示预留的token数量
+_TRUNCATION_NOTE_TOKENS = 48
+# 续传时单次返回内容的最小token数量，保证每次续传至少前进一段内容
+MIN_CONTINUE_TOKENS = _TRUNCATION_NOTE_TOKENS + 1
+
 class KnowledgeService:
     def __init__(self, knowledge_file="knowledge.json"):
         self.knowledge_file = knowledge_file
@@ -41,16 +50,91 @@ class KnowledgeService:
             })
         return descriptions
     
-    def query_knowledge_detail(self, indices: List[int]) -> List[str]:
+    def query_knowledge_detail(self, indices: List[int], max_tokens: Optional[int] = None) -> List[str]:
         """
         查询具体知识细节
         
         参数:
             indices: 知识索引列表
+            max_tokens: 所有知识详情的总token上限 (可选)，超出时较长的知识会被截断并附带续传句柄
             
         返回:
             知识详情列表
+            
+        异常:
+            ValueError: max_tokens不足以为每条被截断的知识保留内容和截断提示
+        """
+        result = self._render_knowledge_detail(indices)
+        if max_tokens is None:
+            return result
+        
+        budget = max_tokens - _ENTRY_OVERHEAD_TOKENS * len(result)
+        # 已缓存的知识直接使用缓存的token开销，无需重新估算
+        cached = [continuation_cache.lookup(detail) for detail in result]
+        costs = [tokenized.tokens() if tokenized is not None else estimate_tokens(detail)
+                 for tokenized, detail in zip(cached, result)]
+        
+        # 只为会被截断的知识预留截断提示的开销；预留越多截断的知识越多，截断数量不再变化时即为最终分配
+        truncated = 0
+        while True:
+            allocation = allocate_budget(costs, budget - _TRUNCATION_NOTE_TOKENS * truncated)
+            count = sum(1 for allotted, cost in zip(allocation, costs) if allotted < cost)
+            if count == truncated:
+                break
+            truncated = count
+        
+        # 预算不足时被截断的知识只剩截断提示，既超出预算又没有内容，直接报错
+        if any(allotted < cost and allotted < 1 for allotted, cost in zip(allocation, costs)):
+            raise ValueError(f"max_tokens {max_tokens} is too small to return part of every truncated entry")
+        
+        for i, detail in enumerate(result):
+            if allocation[i] >= costs[i]:
+                continue
+            tokenized = cached[i] if cached[i] is not None else TokenizedText(detail)
+            result[i] = self._truncate_detail(tokenized, 0, allocation[i])
+        return result
+    
+    @staticmethod
+    def continue_knowledge_detail(handle: str, max_tokens: Optional[int] = None) -> Optional[str]:
         """
+        根据续传句柄获取被截断知识的后续内容
+        
+        参数:
+            handle: query_knowledge_detail截断时返回的续传句柄
+            max_tokens: 本次返回内容的token上限 (可选)，不小于MIN_CONTINUE_TOKENS，不提供则返回全部剩余内容
+            
+        返回:
+            知识详情的后续内容，句柄无效或已过期时返回None
+            
+        异常:
+            ValueError: max_tokens小于MIN_CONTINUE_TOKENS
+        """
+        if max_tokens is not None and max_tokens < MIN_CONTINUE_TOKENS:
+            raise ValueError(f"max_tokens must be at least {MIN_CONTINUE_TOKENS}")
+        cached = continuation_cache.fetch(handle)
+        if cached is None:
+            return None
+        tokenized, offset = cached
+        # 剩余内容能完整放下时直接返回，只有需要截断时才预留截断提示的开销
+        if max_tokens is None or tokenized.tokens(offset) <= max_tokens:
+            return tokenized.text[offset:]
+        return KnowledgeService._truncate_detail(tokenized, offset, max_tokens - _TRUNCATION_NOTE_TOKENS)
+    
+    @staticmethod
+    def _truncate_detail(tokenized: TokenizedText, start: int, max_tokens: int) -> str:
+        """从start开始截取不超过max_tokens的内容，有剩余时附加截断提示和续传句柄"""
+        end = tokenized.truncate(max_tokens, start)
+        if end >= len(tokenized):
+            return tokenized.text[start:]
+        
+        handle = continuation_cache.store(tokenized, end)
+        remaining = tokenized.tokens(end)
+        return (f"{tokenized.text[start:end]}\n\n"
+                f"[Truncated, about {remaining} tokens remaining. "
+                f"Use continue_knowledge with handle \"{handle}\" to fetch the rest]")
+    
+    def _render_knowledge_detail(self, indices: List[int]) -> List[str]:
+        """渲染知识详情，组合description、detail、detail_file和detail_script的内容"""
         knowledge_dict = self._load_knowledge()
         result = []
         
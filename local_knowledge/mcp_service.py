@@ -13,7 +13,7 @@ from mcp.types import (
 from mcp.shared.exceptions import McpError
 from pydantic import BaseModel, Field
 
-from .knowledge_service import KnowledgeService
+from .knowledge_service import KnowledgeService, MIN_CONTINUE_TOKENS
 
 # 定义请求模型
 class AddKnowledgeModel(BaseModel):
@@ -34,13 +34,18 @@ class UpdateKnowledgeModel(BaseModel):
 class QueryKnowledgeModel(BaseModel):
     directory: Annotated[str, Field(description="知识文件所在的目录路径，如无特殊需求请传递当前工作目录（绝对路径）")]
     indices: Annotated[List[int], Field(description="要查询的知识序号列表")]
+    max_tokens: Annotated[Optional[int], Field(description="返回内容的总token上限，超出时较长的知识会被截断并返回续传句柄，不提供则不限制", default=None, gt=0)]
+
+class ContinueKnowledgeModel(BaseModel):
+    handle: Annotated[str, Field(description="query_knowledge截断知识时返回的续传句柄")]
+    max_tokens: Annotated[Optional[int], Field(description=f"本次返回内容的token上限，不小于{MIN_CONTINUE_TOKENS}，不提供则返回全部剩余内容", default=None, ge=MIN_CONTINUE_TOKENS)]
 
 class ListKnowledgeModel(BaseModel):
     directory: Annotated[str, Field(description="知识文件所在的目录路径，如无特殊需求请传递当前工作目录（绝对路径）")]
 
 
-async def serve():
-    """运行本地知识MCP服务"""
+def create_server() -> Server:
+    """创建本地知识MCP服务并注册工具和提示"""
     server = Server("local-knowledge")
     
     @server.list_tools()
@@ -56,6 +61,11 @@ async def serve():
                 description="通过序号查询具体知识细节，返回指定序号的知识内容。需要传递知识库所在目录路径，如无特殊需求请传递当前工作目录（绝对路径）",
                 inputSchema=QueryKnowledgeModel.model_json_schema(),
             ),
+            Tool(
+                name="continue_knowledge",
+                description="通过续传句柄获取被query_knowledge截断的知识的后续内容",
+                inputSchema=ContinueKnowledgeModel.model_json_schema(),
+            ),
             Tool(
                 name="add_knowledge",
                 description="添加新的知识，可以提供知识描述、具体内容、内容文件路径或脚本路径。需要传递知识库所在目录路径，如无特殊需求请传递当前工作目录（绝对路径）",
@@ -95,6 +105,27 @@ async def serve():
                         name="indices", 
                         description="要查询的知识序号列表，例如 [0, 1, 2]", 
                         required=True
+                    ),
+                    PromptArgument(
+                        name="max_tokens", 
+                        description="返回内容的总token上限，超出时较长的知识会被截断并返回续传句柄", 
+                        required=False
+                    )
+                ],
+            ),
+            Prompt(
+                name="continue_knowledge",
+                description="通过续传句柄获取被query_knowledge截断的知识的后续内容",
+                arguments=[
+                    PromptArgument(
+                        name="handle", 
+                        description="query_knowledge截断知识时返回的续传句柄", 
+                        required=True
+                    ),
+                    PromptArgument(
+                        name="max_tokens", 
+                        description=f"本次返回内容的token上限，不小于{MIN_CONTINUE_TOKENS}，不提供则返回全部剩余内容", 
+                        required=False
                     )
                 ],
             ),
@@ -196,10 +227,25 @@ async def serve():
                 
                 knowledge_path = get_knowledge_path(args.directory)
                 knowledge_service = KnowledgeService(knowledge_path)
-                details = knowledge_service.query_knowledge_detail(args.indices)
+                try:
+                    details = knowledge_service.query_knowledge_detail(args.indices, args.max_tokens)
+                except ValueError as e:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message=str(e)))
                 result_text = "\n\n".join([f"知识 {idx}:\n{detail}" for idx, detail in zip(args.indices, details)])
                 return [TextContent(type="text", text=result_text)]
             
+            elif name == "continue_knowledge":
+                try:
+                    args = ContinueKnowledgeModel(**arguments)
+                except ValueError as e:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message=str(e)))
+                
+                # 续传内容已缓存在服务进程中，无需读取知识库文件
+                detail = KnowledgeService.continue_knowledge_detail(args.handle, args.max_tokens)
+                if detail is None:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message=f"续传句柄无效或已过期，请重新查询知识: {args.handle}"))
+                return [TextContent(type="text", text=detail)]
+            
             elif name == "add_knowledge":
                 try:
                     args = AddKnowledgeModel(**arguments)
@@ -284,7 +330,18 @@ async def serve():
                 directory = arguments["directory"]
                 knowledge_path = get_knowledge_path(directory)
                 knowledge_service = KnowledgeService(knowledge_path)
-                details = knowledge_service.query_knowledge_detail(indices)
+                max_tokens = arguments.get("max_tokens")
+                try:
+                    max_tokens = int(max_tokens) if max_tokens is not None else None
+                except ValueError:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message="max_tokens必须是一个整数"))
+                if max_tokens is not None and max_tokens <= 0:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message="max_tokens必须大于0"))
+                
+                try:
+                    details = knowledge_service.query_knowledge_detail(indices, max_tokens)
+                except ValueError as e:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message=str(e)))
                 result_text = "\n\n".join([f"知识 {idx}:\n{detail}" for idx, detail in zip(indices, details)])
                 
                 return GetPromptResult(
@@ -297,6 +354,31 @@ async def serve():
                     ]
                 )
             
+            elif name == "continue_knowledge":
+                if not arguments or "handle" not in arguments:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message="handle参数必须提供"))
+                
+                max_tokens = arguments.get("max_tokens")
+                try:
+                    max_tokens = int(max_tokens) if max_tokens is not None else None
+                except ValueError:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message="max_tokens必须是一个整数"))
+                if max_tokens is not None and max_tokens < MIN_CONTINUE_TOKENS:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message=f"max_tokens不能小于{MIN_CONTINUE_TOKENS}"))
+                
+                detail = KnowledgeService.continue_knowledge_detail(arguments["handle"], max_tokens)
+                if detail is None:
+                    raise McpError(ErrorData(code=INVALID_PARAMS, message=f"续传句柄无效或已过期，请重新查询知识: {arguments['handle']}"))
+                return GetPromptResult(
+                    description="知识详情续传",
+                    messages=[
+                        PromptMessage(
+                            role="user", 
+                            content=TextContent(type="text", text=detail)
+                        )
+                    ]
+                )
+            
             elif name == "add_knowledge":
                 if not arguments or "description" not in arguments or "directory" not in arguments:
                     raise McpError(ErrorData(code=INVALID_PARAMS, message="description和directory参数必须提供"))
@@ -357,7 +439,12 @@ async def serve():
         except Exception as e:
             raise McpError(ErrorData(code=INTERNAL_ERROR, message=f"服务器错误: {str(e)}"))
 
-    # 运行服务器
+    return server
+
+
+async def serve():
+    """运行本地知识MCP服务"""
+    server = create_server()
     options = server.create_initialization_options()
     async with stdio_server() as (read_stream, write_stream):
         await server.run(read_stream, write_stream, options, raise_exceptions=True)
@@ -0,0 +1,200 @@
+import re
+import hashlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from typing import List, Optional, Tuple
+
+# 中日韩字符（含全角符号）大致每个字符对应一个token，其余字符（拉丁字母、数字、空白等）大致每4个字符对应一个token
+_CJK_PATTERN = re.compile(
+    "[\u1100-\u11ff\u2e80-\u2fdf\u3000-\u303f\u3040-\u30ff\u3100-\u31ff"
+    "\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]"
+)
+_CJK_RUN_PATTERN = re.compile(_CJK_PATTERN.pattern + "+")
+_CHARS_PER_TOKEN = 4
+
+# 续传句柄缓存的最大条目数
+_CONTINUATION_CACHE_SIZE = 128
+# 续传句柄缓存的文本总字符数上限，每个字符另有4字节的前缀开销
+_CONTINUATION_CACHE_CHARS = 4 * 1024 * 1024
+
+
+def text_key(text: str) -> str:
+    """计算文本的缓存键"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量
+
+    参数:
+        text: 待估算的文本
+
+    返回:
+        估算的token数量
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+class TokenizedText:
+    """
+    带前缀token开销的文本
+
+    前缀开销以四分之一token为单位，构建一次后，任意片段的估算和截断都只需常数或对数时间，
+    不必重新扫描文本
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.key = text_key(text)
+        costs = bytearray([1]) * len(text)
+        for match in _CJK_RUN_PATTERN.finditer(text):
+            costs[match.start():match.end()] = bytes([_CHARS_PER_TOKEN]) * (match.end() - match.start())
+        self._prefix = array("I", [0])
+        self._prefix.extend(accumulate(costs))
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def tokens(self, start: int = 0, end: Optional[int] = None) -> int:
+        """
+        估算text[start:end]的token数量
+
+        参数:
+            start: 起始位置
+            end: 结束位置（不包含），默认为文本末尾
+
+        返回:
+            估算的token数量，与estimate_tokens(text[start:end])一致
+        """
+        if end is None:
+            end = len(self.text)
+        cost = self._prefix[end] - self._prefix[start]
+        return (cost + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+    def truncate(self, max_tokens: int, start: int = 0) -> int:
+        """
+        从start开始截取不超过max_tokens的文本，返回截断位置
+
+        参数:
+            max_tokens: token上限
+            start: 起始位置
+
+        返回:
+            截断位置（不包含），如果剩余文本都能放下则返回len(text)
+        """
+        if max_tokens <= 0:
+            return start
+        if self.tokens(start) <= max_tokens:
+            return len(self.text)
+
+        end = bisect_right(self._prefix, self._prefix[start] + max_tokens * _CHARS_PER_TOKEN) - 1
+
+        # 如果截断位置附近有换行，则在换行处截断，保持段落完整
+        newline = self.text.rfind("\n", start, end)
+        if newline > start and end - newline <= (end - start) // 5:
+            end = newline + 1
+        return end
+
+
+def allocate_budget(costs: List[int], total: int) -> List[int]:
+    """
+    将token预算公平地分配给多条知识：较短的知识完整保留，剩余预算由较长的知识平分
+
+    参数:
+        costs: 每条知识的token数量
+        total: 总token预算
+
+    返回:
+        每条知识分配到的token数量
+    """
+    allocation = [0] * len(costs)
+    remaining = max(total, 0)
+    pending = sorted(range(len(costs)), key=lambda i: costs[i])
+    while pending:
+        share = remaining // len(pending)
+        index = pending[0]
+        if costs[index] > share:
+            # 剩余的知识都超过平均份额，平分剩余预算，余数依次分配
+            extra = remaining - share * len(pending)
+            for order, index in enumerate(pending):
+                allocation[index] = share + (1 if order < extra else 0)
+            break
+        allocation[index] = costs[index]
+        remaining -= costs[index]
+        pending.pop(0)
+    return allocation
+
+
+class ContinuationCache:
+    """缓存已渲染的知识详情及其前缀token开销，供续传句柄分段获取剩余内容，无需重新渲染或估算"""
+
+    def __init__(self, max_size: int = _CONTINUATION_CACHE_SIZE, max_chars: int = _CONTINUATION_CACHE_CHARS):
+        self.max_size = max_size
+        self.max_chars = max_chars
+        self._chars = 0
+        self._texts: "OrderedDict[str, TokenizedText]" = OrderedDict()
+
+    def lookup(self, text: str) -> Optional[TokenizedText]:
+        """
+        查找已缓存的文本
+
+        参数:
+            text: 已渲染的完整文本
+
+        返回:
+            缓存的TokenizedText，未缓存时返回None
+        """
+        return self._texts.get(text_key(text))
+
+    def store(self, tokenized: TokenizedText, offset: int) -> str:
+        """
+        缓存文本并返回从offset开始的续传句柄
+
+        超出条目数或总字符数上限时淘汰最久未使用的文本，但始终保留刚缓存的文本
+
+        参数:
+            tokenized: 已渲染的完整文本
+            offset: 剩余内容的起始位置
+
+        返回:
+            续传句柄
+        """
+        if tokenized.key not in self._texts:
+            self._texts[tokenized.key] = tokenized
+            self._chars += len(tokenized)
+        self._texts.move_to_end(tokenized.key)
+        while len(self._texts) > 1 and (len(self._texts) > self.max_size or self._chars > self.max_chars):
+            _, evicted = self._texts.popitem(last=False)
+            self._chars -= len(evicted)
+        return f"{tokenized.key}:{offset}"
+
+    def fetch(self, handle: str) -> Optional[Tuple[TokenizedText, int]]:
+        """
+        根据续传句柄获取缓存的文本和剩余内容的起始位置
+
+        参数:
+            handle: 续传句柄
+
+        返回:
+            (缓存的文本, 起始位置)，句柄无效或已过期时返回None
+        """
+        key, _, offset = handle.partition(":")
+        if key not in self._texts or not offset.isdigit():
+            return None
+        tokenized = self._texts[key]
+        self._texts.move_to_end(key)
+        offset = int(offset)
+        if offset > len(tokenized):
+            return None
+        return tokenized, offset
+
+
+# 服务进程内共享的续传缓存
+continuation_cache = ContinuationCache()
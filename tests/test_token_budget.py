@@ -0,0 +1,196 @@
+import asyncio
+import re
+
+import pytest
+from mcp.shared.exceptions import McpError
+from mcp.types import (
+    CallToolRequest, CallToolRequestParams, GetPromptRequest, GetPromptRequestParams, INVALID_PARAMS
+)
+
+from local_knowledge.knowledge_service import KnowledgeService, MIN_CONTINUE_TOKENS
+from local_knowledge.mcp_service import create_server
+from local_knowledge.token_budget import (
+    ContinuationCache, TokenizedText, allocate_budget, continuation_cache, estimate_tokens
+)
+
+_HANDLE_PATTERN = re.compile(r'handle "([^"]+)"')
+
+
+@pytest.fixture
+def knowledge_service(tmp_path):
+    return KnowledgeService(str(tmp_path / ".knowledge"))
+
+
+def _handle(text):
+    match = _HANDLE_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+def test_estimate_tokens_cjk_and_latin():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("中文内容") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("你好world") == 4
+
+
+def test_allocate_budget_keeps_short_entries_whole():
+    assert allocate_budget([10, 500, 1000], 300) == [10, 145, 145]
+    assert allocate_budget([10, 20], 100) == [10, 20]
+    assert allocate_budget([100, 100, 100], 10) == [4, 3, 3]
+    assert allocate_budget([5, 5], -1) == [0, 0]
+
+
+def test_tokenized_text_matches_estimate():
+    text = "中文内容。lorem ipsum\n" * 50
+    tokenized = TokenizedText(text)
+    assert tokenized.tokens() == estimate_tokens(text)
+    assert tokenized.tokens(7, 300) == estimate_tokens(text[7:300])
+
+
+def test_truncate_respects_budget():
+    text = "lorem ipsum dolor\n" * 100
+    tokenized = TokenizedText(text)
+    end = tokenized.truncate(50)
+    assert 0 < end < len(text)
+    assert estimate_tokens(text[:end]) <= 50
+    assert tokenized.truncate(10 ** 6) == len(text)
+    assert tokenized.truncate(0, 7) == 7
+
+
+def test_continuation_cache_evicts_oldest():
+    cache = ContinuationCache(max_size=2)
+    first_text, second_text = TokenizedText("first"), TokenizedText("second")
+    first = cache.store(first_text, 1)
+    second = cache.store(second_text, 2)
+    assert cache.fetch(first) == (first_text, 1)
+    cache.store(TokenizedText("third"), 3)
+    assert cache.fetch(second) is None
+    assert cache.fetch(first) == (first_text, 1)
+    assert cache.lookup("first") is first_text
+    assert cache.fetch("unknown:0") is None
+    assert cache.fetch(first.split(":")[0] + ":99") is None
+
+
+def test_continuation_cache_limits_total_chars():
+    cache = ContinuationCache(max_chars=100)
+    first = cache.store(TokenizedText("a" * 60), 0)
+    second = cache.store(TokenizedText("b" * 60), 0)
+    assert cache.fetch(first) is None
+    assert cache.fetch(second) is not None
+    # 单条超过上限的文本仍会保留，保证刚返回的续传句柄可用
+    third = cache.store(TokenizedText("c" * 200), 0)
+    assert cache.fetch(second) is None
+    assert cache.fetch(third) is not None
+
+
+def test_query_keeps_short_entries_and_respects_budget(knowledge_service):
+    knowledge_service.add_knowledge("short", detail="tiny")
+    knowledge_service.add_knowledge("cjk", detail="中文内容。\n" * 400)
+    knowledge_service.add_knowledge("latin", detail="lorem ipsum dolor\n" * 800)
+    indices = [0, 1, 2]
+    whole = knowledge_service.query_knowledge_detail(indices)
+
+    details = knowledge_service.query_knowledge_detail(indices, 400)
+    result_text = "\n\n".join(f"知识 {idx}:\n{detail}" for idx, detail in zip(indices, details))
+    assert estimate_tokens(result_text) <= 400
+    assert details[0] == whole[0]
+    assert _handle(details[1]) and _handle(details[2])
+
+
+def test_query_rejects_budget_too_small(knowledge_service):
+    knowledge_service.add_knowledge("long", detail="x" * 10000)
+    knowledge_service.add_knowledge("a", detail="y" * 100)
+    knowledge_service.add_knowledge("b", detail="z" * 100)
+    with pytest.raises(ValueError):
+        knowledge_service.query_knowledge_detail([0, 1, 2], 60)
+
+
+def test_continuation_makes_progress_with_small_budget(knowledge_service):
+    detail = "中文内容。lorem ipsum\n" * 300
+    knowledge_service.add_knowledge("long", detail=detail)
+    whole = knowledge_service.query_knowledge_detail([0])[0]
+
+    first = knowledge_service.query_knowledge_detail([0], 100)[0]
+    chunks = [first[:first.rfind("\n\n[Truncated")]]
+    handle = _handle(first)
+    offsets = []
+    while handle is not None:
+        offsets.append(int(handle.split(":")[1]))
+        chunk = KnowledgeService.continue_knowledge_detail(handle, MIN_CONTINUE_TOKENS)
+        assert estimate_tokens(chunk) <= MIN_CONTINUE_TOKENS
+        handle = _handle(chunk)
+        chunks.append(chunk[:chunk.rfind("\n\n[Truncated")] if handle else chunk)
+
+    assert offsets == sorted(set(offsets))
+    assert "".join(chunks) == whole
+
+
+def test_continuation_rejects_small_budget_and_unknown_handle(knowledge_service):
+    with pytest.raises(ValueError):
+        KnowledgeService.continue_knowledge_detail("unknown:0", MIN_CONTINUE_TOKENS - 1)
+    assert KnowledgeService.continue_knowledge_detail("unknown:0") is None
+
+
+def test_continuation_returns_remainder_without_note_when_it_fits():
+    text = "head" * 50 + "tail" * 100
+    handle = continuation_cache.store(TokenizedText(text), 200)
+    assert estimate_tokens(text[200:]) == 100
+
+    chunk = KnowledgeService.continue_knowledge_detail(handle, 120)
+    assert chunk == "tail" * 100
+
+
+def _call_tool(name, arguments):
+    server = create_server()
+    request = CallToolRequest(method="tools/call", params=CallToolRequestParams(name=name, arguments=arguments))
+    return asyncio.run(server.request_handlers[CallToolRequest](request)).root
+
+
+def _get_prompt(name, arguments):
+    server = create_server()
+    # 提示参数在协议中是字符串，这里跳过校验以便传递indices列表
+    params = GetPromptRequestParams.model_construct(name=name, arguments=arguments)
+    request = GetPromptRequest(method="prompts/get", params=params)
+    return asyncio.run(server.request_handlers[GetPromptRequest](request)).root
+
+
+@pytest.mark.parametrize("arguments, message", [
+    ({"handle": "unknown:0"}, "续传句柄无效或已过期"),
+    ({"handle": "unknown:0", "max_tokens": "many"}, "max_tokens"),
+    ({"handle": "unknown:0", "max_tokens": MIN_CONTINUE_TOKENS - 1}, "max_tokens"),
+])
+def test_continue_knowledge_tool_rejects_invalid_params(arguments, message):
+    result = _call_tool("continue_knowledge", arguments)
+    assert result.isError
+    assert message in result.content[0].text
+
+
+@pytest.mark.parametrize("arguments, message", [
+    ({"handle": "unknown:0"}, "续传句柄无效或已过期"),
+    ({"handle": "unknown:0", "max_tokens": "many"}, "max_tokens必须是一个整数"),
+    ({"handle": "unknown:0", "max_tokens": str(MIN_CONTINUE_TOKENS - 1)}, "max_tokens不能小于"),
+])
+def test_continue_knowledge_prompt_rejects_invalid_params(arguments, message):
+    with pytest.raises(McpError) as excinfo:
+        _get_prompt("continue_knowledge", arguments)
+    assert excinfo.value.error.code == INVALID_PARAMS
+    assert message in excinfo.value.error.message
+
+
+def test_query_knowledge_prompt_rejects_non_positive_max_tokens(tmp_path):
+    with pytest.raises(McpError) as excinfo:
+        _get_prompt("query_knowledge", {"directory": str(tmp_path), "indices": [0], "max_tokens": "0"})
+    assert excinfo.value.error.code == INVALID_PARAMS
+    assert "max_tokens必须大于0" in excinfo.value.error.message
+
+
+def test_continue_knowledge_tool_follows_handles(tmp_path):
+    KnowledgeService(str(tmp_path / ".knowledge")).add_knowledge("long", detail="lorem ipsum dolor\n" * 200)
+    result = _call_tool("query_knowledge", {"directory": str(tmp_path), "indices": [0], "max_tokens": 200})
+    assert not result.isError
+    handle = _handle(result.content[0].text)
+    while handle is not None:
+        result = _call_tool("continue_knowledge", {"handle": handle, "max_tokens": 200})
+        assert not result.isError
+        handle = _handle(result.content[0].text)